@@ -0,0 +1,465 @@
+"""
+In-memory columnar analytics for time reports.
+
+Loads every entry once into compact columns (employee and task names are
+dictionary-encoded, dates are stored as day numbers) and answers group-by,
+filter and top-N questions without going back to SQLite row by row:
+
+    report = EntryColumns().load()
+    report.minutes_by(("employee", "task", "week"), "2016-01-01", "2016-12-31")
+    report.top(5, ("task",))
+    report.refresh()
+
+NumPy is used for the calculations when it is installed; otherwise the
+columns are plain `array` arrays and the queries fall back to Python loops.
+
+Loading installs triggers that log changed entry ids to an `entry_change`
+table, which `refresh()` reads to pick up inserts, edits and deletes since
+the last load. Every loaded copy records how far it has read in
+`entry_change_consumer`; `prune_change_log()` (run by maintenance.py)
+deletes the changes all of them have seen and switches the log off again
+once no copies are left. `disable_change_log()` switches it off at once.
+"""
+from entry import db
+
+import heapq, sys, time, uuid
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+CHANGE_LOG_SQL = [
+    'CREATE TABLE IF NOT EXISTS "entry_change" ('
+    '"seq" INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, '
+    '"entry_id" INTEGER NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS "entry_change_consumer" ('
+    '"name" TEXT NOT NULL PRIMARY KEY, "seq" INTEGER NOT NULL, '
+    '"updated" REAL NOT NULL)',
+    'CREATE TRIGGER IF NOT EXISTS "entry_change_insert" AFTER INSERT ON '
+    '"entry" BEGIN INSERT INTO "entry_change" ("entry_id") '
+    'VALUES (new."id"); END',
+    'CREATE TRIGGER IF NOT EXISTS "entry_change_update" AFTER UPDATE ON '
+    '"entry" BEGIN INSERT INTO "entry_change" ("entry_id") '
+    'VALUES (old."id"), (new."id"); END',
+    'CREATE TRIGGER IF NOT EXISTS "entry_change_delete" AFTER DELETE ON '
+    '"entry" BEGIN INSERT INTO "entry_change" ("entry_id") '
+    'VALUES (old."id"); END',
+]
+
+DROP_CHANGE_LOG_SQL = [
+    'DROP TRIGGER IF EXISTS "entry_change_insert"',
+    'DROP TRIGGER IF EXISTS "entry_change_update"',
+    'DROP TRIGGER IF EXISTS "entry_change_delete"',
+    'DROP TABLE IF EXISTS "entry_change"',
+    'DROP TABLE IF EXISTS "entry_change_consumer"',
+]
+
+# Consumers that haven't refreshed for this many seconds are forgotten
+STALE_CONSUMER_AGE = 7 * 24 * 60 * 60
+
+SELECT_SQL = ('SELECT "id", "employee_name", "task_name", "minutes", "date" '
+              'FROM "entry"')
+
+GROUP_KEYS = ("employee", "task", "day", "week")
+
+# Maximum number of ids in one "id IN (...)" lookup
+BATCH_SIZE = 500
+
+# Group key spaces up to this size are always counted with a dense bincount
+BINCOUNT_SIZE = 1 << 20
+
+
+def to_day(value):
+    """Convert a date, datetime or YYYY-MM-DD string to a day number."""
+    if isinstance(value, (date, datetime)):
+        return value.toordinal()
+    value = str(value)
+    return date(int(value[:4]), int(value[5:7]), int(value[8:10])).toordinal()
+
+
+def to_week(day):
+    """Day number of the Monday starting the week of `day`."""
+    # Day 1 (0001-01-01) was a Monday
+    return day - (day - 1) % 7
+
+
+def change_log_enabled(database=db):
+    """Check if the change log triggers are installed."""
+    return database.execute_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+        "AND name = 'entry_change_consumer'").fetchone() is not None
+
+
+def enable_change_log(database=db):
+    """Install the change log table and triggers."""
+    with database.atomic():
+        for sql in CHANGE_LOG_SQL:
+            database.execute_sql(sql)
+
+
+def disable_change_log(database=db):
+    """
+    Drop the change log triggers and tables. Loaded copies reload everything
+    on their next refresh.
+    """
+    with database.atomic():
+        for sql in DROP_CHANGE_LOG_SQL:
+            database.execute_sql(sql)
+
+
+def prune_change_log(database=db, max_age=STALE_CONSUMER_AGE):
+    """
+    Forget consumers that haven't refreshed for `max_age` seconds and delete
+    the changes every remaining consumer has read. With no consumers left the
+    change log is switched off. Returns the number of changes deleted.
+    """
+    if not change_log_enabled(database):
+        return 0
+    with database.atomic():
+        database.execute_sql(
+            'DELETE FROM "entry_change_consumer" WHERE "updated" < ?',
+            (time.time() - max_age,))
+        oldest = database.execute_sql(
+            'SELECT MIN("seq") FROM "entry_change_consumer"').fetchone()[0]
+        if oldest is None:
+            pruned = database.execute_sql(
+                'SELECT COUNT(*) FROM "entry_change"').fetchone()[0]
+            disable_change_log(database)
+            return pruned
+        return database.execute_sql(
+            'DELETE FROM "entry_change" WHERE "seq" <= ?',
+            (oldest,)).rowcount
+
+
+class Dictionary:
+    """Maps repeated strings to small integer codes and back."""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value):
+        """Return the code for `value`, adding it if it's new."""
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+class EntryColumns:
+    """Columnar copy of the entry table held in memory."""
+
+    def __init__(self, database=db, name=None):
+        self.database = database
+        # Name this copy's read position is stored under in the database
+        self.name = name or uuid.uuid4().hex
+        self.employees = Dictionary()
+        self.tasks = Dictionary()
+        self.last_change = 0
+        self._day_cache = {}
+        self._clear()
+
+    def _clear(self):
+        # ids are kept sorted so rows can be found with a binary search
+        self.ids = array("q")
+        self.employee_codes = array("l")
+        self.task_codes = array("l")
+        self.days = array("l")
+        self.minutes = array("q")
+        self.alive = array("b")
+
+    def _day(self, value):
+        """to_day() with a cache, since the same dates repeat a lot."""
+        key = value if isinstance(value, str) else str(value)
+        day = self._day_cache.get(key[:10])
+        if day is None:
+            day = self._day_cache[key[:10]] = to_day(value)
+        return day
+
+    def _append(self, row):
+        entry_id, employee_name, task_name, minutes, entry_date = row
+        self.ids.append(entry_id)
+        self.employee_codes.append(self.employees.encode(employee_name))
+        self.task_codes.append(self.tasks.encode(task_name))
+        self.days.append(self._day(entry_date))
+        self.minutes.append(int(minutes))
+        self.alive.append(1)
+
+    def _set(self, index, row):
+        entry_id, employee_name, task_name, minutes, entry_date = row
+        self.employee_codes[index] = self.employees.encode(employee_name)
+        self.task_codes[index] = self.tasks.encode(task_name)
+        self.days[index] = self._day(entry_date)
+        self.minutes[index] = int(minutes)
+        self.alive[index] = 1
+
+    def _find(self, entry_id):
+        """Return the position of an entry id, or None if not loaded."""
+        index = bisect_left(self.ids, entry_id)
+        if index < len(self.ids) and self.ids[index] == entry_id:
+            return index
+        return None
+
+    def _latest_change(self):
+        """Return the sequence number of the newest logged change."""
+        # Pruning may have emptied the table, but AUTOINCREMENT remembers
+        row = self.database.execute_sql(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'entry_change'"
+            ).fetchone()
+        return row[0] if row else 0
+
+    def _save_position(self):
+        """Store how far this copy has read the change log."""
+        self.database.execute_sql(
+            'INSERT OR REPLACE INTO "entry_change_consumer" '
+            '("name", "seq", "updated") VALUES (?, ?, ?)',
+            (self.name, self.last_change, time.time()))
+
+    def load(self):
+        """Load every entry into memory and start logging changes."""
+        with self.database.atomic():
+            enable_change_log(self.database)
+            self.last_change = self._latest_change()
+            self._save_position()
+            self._clear()
+            cursor = self.database.execute_sql(SELECT_SQL + ' ORDER BY "id"')
+            while True:
+                rows = cursor.fetchmany(10000)
+                if not rows:
+                    break
+                for row in rows:
+                    self._append(row)
+        return self
+
+    def refresh(self):
+        """
+        Apply the inserts, edits and deletes made since the last load or
+        refresh. Returns the number of changed entries. If the change log was
+        switched off or this copy was forgotten in the meantime, everything
+        is loaded again and the number of loaded entries is returned.
+        """
+        with self.database.atomic():
+            registered = (change_log_enabled(self.database) and
+                          self.database.execute_sql(
+                              'SELECT 1 FROM "entry_change_consumer" '
+                              'WHERE "name" = ?', (self.name,)).fetchone())
+            if not registered:
+                self.load()
+                return len(self.ids)
+            latest = self._latest_change()
+            changed = sorted(row[0] for row in self.database.execute_sql(
+                'SELECT DISTINCT "entry_id" FROM "entry_change" '
+                'WHERE "seq" > ? AND "seq" <= ?',
+                (self.last_change, latest)))
+            rows = {}
+            for start in range(0, len(changed), BATCH_SIZE):
+                batch = changed[start:start + BATCH_SIZE]
+                sql = SELECT_SQL + ' WHERE "id" IN ({})'.format(
+                    ", ".join("?" * len(batch)))
+                for row in self.database.execute_sql(sql, batch):
+                    rows[row[0]] = row
+            self.last_change = latest
+            self._save_position()
+
+        for entry_id in changed:
+            index = self._find(entry_id)
+            row = rows.get(entry_id)
+            if row is None:
+                if index is not None:
+                    self.alive[index] = 0
+            elif index is not None:
+                self._set(index, row)
+            elif not self.ids or entry_id > self.ids[-1]:
+                self._append(row)
+            else:
+                # An id below the highest loaded one that was never loaded
+                # can only come from outside the application; start over.
+                self.load()
+                break
+        return len(changed)
+
+    def close(self):
+        """Stop tracking changes for this copy."""
+        if change_log_enabled(self.database):
+            self.database.execute_sql(
+                'DELETE FROM "entry_change_consumer" WHERE "name" = ?',
+                (self.name,))
+
+    def _filter(self, start, end, employee, task):
+        """Return the positions of live rows matching the filters."""
+        employee_code = self.employees.codes.get(employee, -1)
+        task_code = self.tasks.codes.get(task, -1)
+        start = to_day(start) if start is not None else None
+        end = to_day(end) if end is not None else None
+
+        if numpy is not None:
+            mask = numpy.frombuffer(self.alive, dtype=numpy.int8) == 1
+            days = numpy.frombuffer(self.days, dtype=self.days.typecode)
+            if start is not None:
+                mask &= days >= start
+            if end is not None:
+                mask &= days <= end
+            if employee is not None:
+                mask &= numpy.frombuffer(
+                    self.employee_codes,
+                    dtype=self.employee_codes.typecode) == employee_code
+            if task is not None:
+                mask &= numpy.frombuffer(
+                    self.task_codes,
+                    dtype=self.task_codes.typecode) == task_code
+            if mask.all():
+                # Indexing with a slice avoids copying every column
+                return slice(None)
+            return numpy.flatnonzero(mask)
+
+        return [
+            index for index in range(len(self.ids))
+            if self.alive[index]
+            and (start is None or self.days[index] >= start)
+            and (end is None or self.days[index] <= end)
+            and (employee is None or
+                 self.employee_codes[index] == employee_code)
+            and (task is None or self.task_codes[index] == task_code)]
+
+    def _decode(self, name, values):
+        """Turn a list of raw group values back into names or dates."""
+        if name == "employee":
+            names = self.employees.values
+            return [names[value] for value in values]
+        if name == "task":
+            names = self.tasks.values
+            return [names[value] for value in values]
+        dates = {day: date.fromordinal(day) for day in set(values)}
+        return [dates[day] for day in values]
+
+    def _group_column(self, name):
+        """The stored column that `name` groups by."""
+        if name == "employee":
+            return self.employee_codes
+        if name == "task":
+            return self.task_codes
+        if name in ("day", "week"):
+            return self.days
+        raise ValueError("Can't group by {!r}; choose from {}".format(
+            name, ", ".join(GROUP_KEYS)))
+
+    def _group_totals(self, group_by, rows):
+        """
+        Total minutes of `rows` per group. Returns one list of raw group
+        values (codes or day numbers) for each name in `group_by`, and a
+        list of the totals, all in the same order.
+        """
+        if numpy is None:
+            columns = []
+            for name in group_by:
+                column = self._group_column(name)
+                column = [column[index] for index in rows]
+                if name == "week":
+                    column = [to_week(day) for day in column]
+                columns.append(column)
+            totals = {}
+            for position, index in enumerate(rows):
+                key = tuple(column[position] for column in columns)
+                totals[key] = totals.get(key, 0) + self.minutes[index]
+            parts = [[key[position] for key in totals]
+                     for position in range(len(group_by))]
+            return parts, list(totals.values())
+
+        minutes = numpy.frombuffer(
+            self.minutes, dtype=self.minutes.typecode)[rows]
+        if not len(minutes):
+            return [[] for name in group_by], []
+
+        # Combine the groups into one mixed-radix integer key: codes are
+        # dense already, days and weeks are offset from the earliest one.
+        key = numpy.zeros(len(minutes), dtype=numpy.int64)
+        dims, origins = [], []
+        for name in group_by:
+            column = self._group_column(name)
+            column = numpy.frombuffer(
+                column, dtype=column.typecode)[rows].astype(numpy.int64)
+            if name in ("day", "week"):
+                step = 7 if name == "week" else 1
+                if name == "week":
+                    # Week number counted from day 1, a Monday
+                    column = (column - 1) // 7
+                low = int(column.min())
+                column -= low
+                origin = low * step + 1 if name == "week" else low
+                dim = int(column.max()) + 1
+            else:
+                origin = step = None
+                dim = len(self.employees if name == "employee" else self.tasks)
+            key *= dim
+            key += column
+            dims.append(dim)
+            origins.append((origin, step))
+
+        size = 1
+        for dim in dims:
+            size *= dim
+        if size <= max(2 * len(key), BINCOUNT_SIZE):
+            groups = numpy.flatnonzero(numpy.bincount(key, minlength=size))
+            totals = numpy.bincount(key, weights=minutes,
+                                    minlength=size)[groups]
+        else:
+            # Too sparse for a dense count; sort the keys instead
+            groups, inverse = numpy.unique(key, return_inverse=True)
+            totals = numpy.bincount(inverse, weights=minutes)
+
+        parts = []
+        for dim, (origin, step) in zip(reversed(dims), reversed(origins)):
+            groups, part = numpy.divmod(groups, dim)
+            if origin is not None:
+                part = part * step + origin
+            parts.append(part.tolist())
+        parts.reverse()
+        return parts, [int(total) for total in totals.tolist()]
+
+    def minutes_by(self, group_by=("employee", "task", "week"), start=None,
+                   end=None, employee=None, task=None):
+        """
+        Total minutes per group between `start` and `end` (inclusive),
+        optionally for one employee or task. `group_by` is a sequence of
+        "employee", "task", "day" and "week" (the Monday starting the week).
+        Returns a dictionary keyed by tuples in the order of `group_by`.
+        """
+        rows = self._filter(start, end, employee, task)
+        parts, totals = self._group_totals(group_by, rows)
+        decoded = [self._decode(name, part)
+                   for name, part in zip(group_by, parts)]
+        if not group_by:
+            return {(): totals[0]} if totals else {}
+        return dict(zip(zip(*decoded), totals))
+
+    def top(self, n, group_by=("task",), start=None, end=None, employee=None,
+            task=None):
+        """The `n` groups with the most minutes, as (key, minutes) pairs."""
+        rows = self._filter(start, end, employee, task)
+        parts, totals = self._group_totals(group_by, rows)
+        best = heapq.nlargest(n, range(len(totals)), key=totals.__getitem__)
+        decoded = [self._decode(name, [part[index] for index in best])
+                   for name, part in zip(group_by, parts)]
+        return [(key, totals[index])
+                for key, index in zip(zip(*decoded) if group_by else
+                                      [()] * len(best), best)]
+
+
+if __name__ == '__main__':
+    start = sys.argv[1] if len(sys.argv) > 1 else None
+    end = sys.argv[2] if len(sys.argv) > 2 else None
+    db.connect()
+    report = EntryColumns().load()
+    totals = report.minutes_by(("employee", "task", "week"), start, end)
+    for (employee, task, week), minutes in sorted(totals.items()):
+        print("{}  {:<20} {:<20} {:>6}".format(
+            week.strftime("%Y-%m-%d"), employee, task, minutes))
@@ -1,6 +1,7 @@
 from peewee import *
 
 import datetime
+import sqlite3
 
 
 db = SqliteDatabase('entries.db')
@@ -22,8 +23,122 @@ class Entry(Model):
     class Meta:
         database = db
 
+    @classmethod
+    def create_table(cls, fail_silently=False):
+        """
+        Create the table together with its indexes, in the database the
+        table is created in. Nothing is done if the table already exists.
+        """
+        if fail_silently and cls.table_exists():
+            return
+        super().create_table(fail_silently)
+        create_indexes(cls._meta.database)
+
+
+class EntrySearch(Model):
+    """
+    Full-text index over the employee names, task names and notes of
+    entries. The virtual table and the triggers that keep it up to date are
+    made by create_indexes() when SQLite supports them.
+    """
+    rowid = PrimaryKeyField()
+    employee_name = TextField()
+    task_name = TextField()
+    notes = TextField()
+
+    class Meta:
+        database = db
+        db_table = 'entry_fts'
+
+
+def has_trigram_support():
+    """Check if this SQLite has FTS5 with the trigram tokenizer (3.34+)."""
+    conn = sqlite3.connect(':memory:')
+    try:
+        conn.execute("CREATE VIRTUAL TABLE probe USING fts5(text, "
+                     "tokenize='trigram')")
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+    return True
+
+
+# Without it, searches fall back to LIKE over the entry table
+FULL_TEXT_SEARCH = has_trigram_support()
+
+INDEX_SQL = [
+    'CREATE INDEX IF NOT EXISTS "entry_date" ON "entry" ("date")',
+    'CREATE INDEX IF NOT EXISTS "entry_employee_name_date" '
+    'ON "entry" ("employee_name", "date")',
+]
+
+# Each connection reads the full-text index settings the first time it
+# searches. If another connection holds the write lock at that moment, FTS5
+# reports this instead of "database is locked", so treat it as lock
+# contention and retry the search.
+FTS_LOCKED_MESSAGE = "vtable constructor failed"
+
+FTS_COLUMNS = '"employee_name", "task_name", "notes"'
+OLD_FTS_VALUES = 'old."employee_name", old."task_name", old."notes"'
+NEW_FTS_VALUES = 'new."employee_name", new."task_name", new."notes"'
+
+FTS_SQL = [
+    # The trigram tokenizer lets LIKE '%term%' use the full-text index
+    'CREATE VIRTUAL TABLE IF NOT EXISTS "entry_fts" USING fts5('
+    'employee_name, task_name, notes, content=\'entry\', '
+    'content_rowid=\'id\', tokenize=\'trigram\')',
+    'CREATE TRIGGER IF NOT EXISTS "entry_fts_insert" AFTER INSERT ON "entry" '
+    'BEGIN INSERT INTO "entry_fts" (rowid, {columns}) '
+    'VALUES (new."id", {new}); END',
+    'CREATE TRIGGER IF NOT EXISTS "entry_fts_delete" AFTER DELETE ON "entry" '
+    'BEGIN INSERT INTO "entry_fts" ("entry_fts", rowid, {columns}) '
+    'VALUES (\'delete\', old."id", {old}); END',
+    'CREATE TRIGGER IF NOT EXISTS "entry_fts_update" AFTER UPDATE ON "entry" '
+    'BEGIN INSERT INTO "entry_fts" ("entry_fts", rowid, {columns}) '
+    'VALUES (\'delete\', old."id", {old}); '
+    'INSERT INTO "entry_fts" (rowid, {columns}) '
+    'VALUES (new."id", {new}); END',
+]
+
+DROP_FTS_SQL = [
+    'DROP TRIGGER IF EXISTS "entry_fts_insert"',
+    'DROP TRIGGER IF EXISTS "entry_fts_delete"',
+    'DROP TRIGGER IF EXISTS "entry_fts_update"',
+    'DROP TABLE IF EXISTS "entry_fts"',
+]
+
+
+def create_indexes(database=db):
+    """
+    Create the indexes used by the searches. The full-text index is rebuilt
+    whenever its triggers are missing, since it can't be trusted then, and
+    is skipped if SQLite can't provide it.
+    """
+    for sql in INDEX_SQL:
+        database.execute_sql(sql)
+    if not FULL_TEXT_SEARCH:
+        return
+
+    columns = [row[1] for row in database.execute_sql(
+        'PRAGMA table_info("entry_fts")')]
+    if columns and "employee_name" not in columns:
+        # Made before employee names were indexed
+        for sql in DROP_FTS_SQL:
+            database.execute_sql(sql)
+    in_sync = database.execute_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' "
+        "AND name = 'entry_fts_insert'").fetchone()
+    for sql in FTS_SQL:
+        database.execute_sql(sql.format(
+            columns=FTS_COLUMNS, old=OLD_FTS_VALUES, new=NEW_FTS_VALUES))
+    if not in_sync:
+        database.execute_sql(
+            'INSERT INTO "entry_fts" ("entry_fts") VALUES (\'rebuild\')')
+
 
 def initialize():
     """Create the database and the tables if they don't exist."""
     db.connect()
     db.create_tables([Entry], safe=True)
+    create_indexes()
@@ -0,0 +1,183 @@
+"""
+Maintenance tasks for the work log database.
+
+Takes online backups through the SQLite backup API, refreshes the query
+planner statistics and reclaims free pages with incremental auto-vacuum. Run
+`python maintenance.py [BACKUP_DIR] [INTERVAL_SECONDS]` to do a single pass
+(or keep running every INTERVAL_SECONDS), or call `start_scheduler()` from
+another program to run it in a background thread.
+"""
+from entry import db
+import analytics
+
+import logging, os, sys, sqlite3, threading, time
+from datetime import datetime
+
+
+logger = logging.getLogger(__name__)
+
+# SQLite's numeric value for PRAGMA auto_vacuum = INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+# Rows ANALYZE samples from each index, which keeps its cost bounded on
+# large tables (ignored by SQLite before 3.32)
+ANALYSIS_LIMIT = 1000
+
+
+def pragma(name, database=db):
+    """Return the value of a single-valued PRAGMA."""
+    return database.execute_sql("PRAGMA {}".format(name)).fetchone()[0]
+
+
+def get_database_stats(database=db):
+    """Return the size of the database in bytes and its number of free pages."""
+    page_size = pragma("page_size", database)
+    return {
+        "size": page_size * pragma("page_count", database),
+        "freelist_pages": pragma("freelist_count", database),
+    }
+
+
+def enable_incremental_vacuum(database=db):
+    """
+    Switch the database to incremental auto-vacuum. An existing database only
+    picks up the new mode after a full VACUUM, so that is done once here.
+    Returns True if the database had to be converted.
+    """
+    if pragma("auto_vacuum", database) == AUTO_VACUUM_INCREMENTAL:
+        return False
+    database.execute_sql("PRAGMA auto_vacuum = INCREMENTAL")
+    database.execute_sql("VACUUM")
+    return True
+
+
+def incremental_vacuum(pages=None, database=db):
+    """
+    Release up to `pages` free pages (all of them by default). SQLite frees
+    one page each time the statement is stepped, and the sqlite3 module
+    steps a statement without result columns only once, so it is run as a
+    script, which steps it to the end.
+    """
+    if pages is None:
+        sql = "PRAGMA incremental_vacuum"
+    else:
+        sql = "PRAGMA incremental_vacuum({:d})".format(pages)
+    database.get_conn().executescript(sql)
+
+
+def optimize(database=db):
+    """
+    Refresh the query planner statistics. PRAGMA optimize relies on queries
+    made earlier on the same connection, which a maintenance run doesn't
+    have, so ANALYZE runs every time with a sampling limit instead.
+    """
+    database.execute_sql(
+        "PRAGMA analysis_limit = {:d}".format(ANALYSIS_LIMIT))
+    database.execute_sql("ANALYZE")
+
+
+def backup_database(destination, database=db):
+    """
+    Copy the database to `destination` while it stays in use. The backup API
+    starts over whenever another connection writes between steps, so the
+    copy is made in a single step inside one read transaction. In WAL mode
+    writers carry on meanwhile; otherwise they wait for the copy to finish.
+    """
+    target = sqlite3.connect(destination)
+    try:
+        database.get_conn().backup(target, pages=-1)
+    finally:
+        target.close()
+    return destination
+
+
+def get_backup_path(backup_dir):
+    """Build a timestamped file name for a backup in `backup_dir`."""
+    file_name = "entries-{}.db".format(
+        datetime.now().strftime("%Y%m%d-%H%M%S"))
+    return os.path.join(backup_dir, file_name)
+
+
+def run_maintenance(backup_dir=None, database=db):
+    """
+    Back up (if `backup_dir` is given), prune the analytics change log,
+    vacuum and analyze the database. Returns a report of the database size,
+    free pages, pruned changes and time taken.
+    """
+    start = time.perf_counter()
+    before = get_database_stats(database)
+
+    backup = None
+    if backup_dir:
+        backup = backup_database(get_backup_path(backup_dir),
+                                 database=database)
+    pruned = analytics.prune_change_log(database)
+    if not enable_incremental_vacuum(database):
+        incremental_vacuum(database=database)
+    optimize(database)
+
+    after = get_database_stats(database)
+    return {
+        "backup": backup,
+        "size_before": before["size"],
+        "size_after": after["size"],
+        "freelist_before": before["freelist_pages"],
+        "freelist_after": after["freelist_pages"],
+        "changes_pruned": pruned,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def format_report(report):
+    """Format a maintenance report as lines of text."""
+    return "\n".join([
+        "Backup: {}".format(report["backup"] or "skipped"),
+        "Database size: {size_before} -> {size_after} bytes".format(**report),
+        "Freelist pages: {freelist_before} -> {freelist_after}".format(
+            **report),
+        "Change log rows pruned: {}".format(report["changes_pruned"]),
+        "Time taken: {:.3f} seconds".format(report["seconds"]),
+    ])
+
+
+def print_report(report):
+    """Print a maintenance report to the screen."""
+    print(format_report(report))
+
+
+def log_report(report):
+    """Log a maintenance report at INFO level."""
+    logger.info("Maintenance finished\n%s", format_report(report))
+
+
+def start_scheduler(interval, backup_dir=None, database=db,
+                    on_report=log_report):
+    """
+    Run maintenance every `interval` seconds in a daemon thread and pass each
+    report to `on_report` (logged by default). Errors are logged and the
+    scheduler carries on with the next run. Returns an event; set it to stop
+    the scheduler.
+    """
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                report = run_maintenance(backup_dir, database)
+            except Exception:
+                logger.exception("Scheduled maintenance failed")
+                continue
+            on_report(report)
+
+    threading.Thread(target=loop, daemon=True).start()
+    return stop
+
+
+if __name__ == '__main__':
+    backup_dir = sys.argv[1] if len(sys.argv) > 1 else None
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    db.connect()
+    while True:
+        print_report(run_maintenance(backup_dir))
+        if interval is None:
+            break
+        time.sleep(interval)
@@ -0,0 +1,100 @@
+import re
+import unittest
+import unittest.mock as mock
+
+from playhouse.test_utils import test_database
+from peewee import *
+
+import stress
+import worklog
+from entry import Entry, FULL_TEXT_SEARCH
+
+
+PLAN_DB = SqliteDatabase(':memory:')
+
+# A plan step that reads every row of a table. Peewee aliases tables (t1,
+# t2, ...), so any name is matched. Scanning a covering index is allowed
+# since it never touches the table, and the full-text index is a virtual
+# table that handles the LIKE itself.
+FULL_SCAN = re.compile(
+    r'^SCAN (TABLE )?\w+\b(?! VIRTUAL TABLE)(?! USING COVERING INDEX)')
+
+requires_full_text_search = unittest.skipUnless(
+    FULL_TEXT_SEARCH, "SQLite has no FTS5 trigram tokenizer")
+
+
+class QueryPlanTests(unittest.TestCase):
+    """Make sure every search path uses an index instead of a table scan."""
+
+    def setUp(self):
+        database = test_database(PLAN_DB, (Entry,))
+        database.__enter__()
+        self.addCleanup(database.__exit__, None, None, None)
+        stress.populate(500, database=PLAN_DB)
+
+
+    def get_plan(self, query):
+        sql, params = query.sql()
+        cursor = PLAN_DB.execute_sql('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+    def assertNoFullScan(self, query):
+        plan = self.get_plan(query)
+        for step in plan:
+            self.assertIsNone(
+                FULL_SCAN.match(step),
+                "Full scan of entry in plan:\n{}".format("\n".join(plan)))
+
+
+    @requires_full_text_search
+    @mock.patch('worklog.clear_screen')
+    @mock.patch('worklog.list_entries')
+    def test_find_by_employee(self, list_entries, clear_screen):
+        with mock.patch('builtins.input', side_effect=["Brian W"]):
+            self.assertNoFullScan(worklog.find_by_employee())
+
+
+    @requires_full_text_search
+    def test_search_by_employee_last_name(self):
+        self.assertNoFullScan(worklog.search_by_employee("Weber"))
+
+
+    @mock.patch('worklog.clear_screen')
+    def test_check_employee_name_match(self, clear_screen):
+        entries = worklog.search_by_employee("Beth")
+        with mock.patch('builtins.input', side_effect=["Beth Smith"]):
+            self.assertNoFullScan(worklog.check_employee_name_match(entries))
+
+
+    @mock.patch('worklog.clear_screen')
+    @mock.patch('worklog.list_entries')
+    def test_find_by_date(self, list_entries, clear_screen):
+        with mock.patch('builtins.input', side_effect=["2016-06-01"]):
+            self.assertNoFullScan(worklog.find_by_date())
+
+
+    @mock.patch('worklog.clear_screen')
+    @mock.patch('worklog.display_entries')
+    def test_find_by_date_range(self, display_entries, clear_screen):
+        with mock.patch('builtins.input',
+            side_effect=["2016-06-01", "2016-06-30"]):
+            self.assertNoFullScan(worklog.find_by_date_range())
+
+
+    @requires_full_text_search
+    @mock.patch('worklog.clear_screen')
+    @mock.patch('worklog.list_entries')
+    def test_find_by_keyword(self, list_entries, clear_screen):
+        with mock.patch('builtins.input', side_effect=["Surfing"]):
+            self.assertNoFullScan(worklog.find_by_keyword())
+
+
+    def test_get_all_distinct_dates_list(self):
+        self.assertNoFullScan(worklog.select_distinct_dates())
+        self.assertEqual(len(worklog.get_all_distinct_dates_list()),
+                         worklog.select_distinct_dates().count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,347 @@
+"""
+Concurrent load test for the work log database.
+
+Starts several processes, each running several threads, that hammer a
+database with a mix of creates, edits, deletes and searches through the
+non-interactive functions in worklog.py. Reports throughput, latency
+percentiles, time lost waiting on locks, failed transactions and the errors
+behind them so journal modes and pragma settings can be compared, e.g.:
+
+    python stress.py --processes 4 --threads 4 --journal-mode wal
+"""
+from entry import Entry, FTS_LOCKED_MESSAGE, db
+import worklog
+
+import argparse, math, multiprocessing, os, random, threading, time
+from datetime import date, timedelta
+from peewee import OperationalError, fn
+
+
+EMPLOYEES = ["Brian Weber", "Bobby Weber", "Beth Smith", "Beth Jones",
+             "Kenneth Love", "Craig Dennis"]
+TASKS = ["Surfing", "Code review", "Testing", "Meetings", "Deployment",
+         "Documentation", "Bug fixing"]
+# Operations that write, and so take the write lock up front
+WRITES = ("create_entry", "edit_entry", "delete_entry")
+# Files SQLite keeps next to a database while it is in use
+SIDE_FILES = ("-wal", "-shm", "-journal")
+
+FIRST_DATE = date(2016, 1, 1)
+DAYS = 365
+
+# Relative weight of each operation in the default mixed workload
+WORKLOAD = [
+    ("create_entry", 20),
+    ("edit_entry", 15),
+    ("delete_entry", 5),
+    ("find_by_employee", 15),
+    ("find_by_date", 15),
+    ("find_by_date_range", 15),
+    ("find_by_keyword", 15),
+]
+
+
+def random_date(rng):
+    """Pick a random date string in the test year."""
+    day = FIRST_DATE + timedelta(days=rng.randrange(DAYS))
+    return worklog.convert_datetime_to_string(day)
+
+
+def random_entry(rng):
+    """Build a random entry dictionary like the one get_user_entry returns."""
+    return {
+        "employee_name": rng.choice(EMPLOYEES),
+        "date": random_date(rng),
+        "task_name": rng.choice(TASKS),
+        "minutes": rng.randint(5, 480),
+        "notes": "Load test entry {}".format(rng.random()),
+    }
+
+
+def populate(rows, seed=0, database=db):
+    """Insert `rows` random entries in batches."""
+    rng = random.Random(seed)
+    with database.atomic():
+        for start in range(0, rows, 100):
+            batch = [random_entry(rng) for _ in range(min(100, rows - start))]
+            Entry.insert_many(batch).execute()
+
+
+def get_max_id():
+    """Return the highest entry id in the database."""
+    return Entry.select(fn.Max(Entry.id)).scalar() or 0
+
+
+def run_operation(name, rng, state):
+    """Run one operation of the workload. Queries are fully evaluated."""
+    if name == "create_entry":
+        worklog.create_entry(random_entry(rng))
+        state["max_id"] += 1
+    elif name in ("edit_entry", "delete_entry"):
+        entry = Entry.select().where(
+            Entry.id == rng.randint(1, max(state["max_id"], 1))).first()
+        if entry is None:
+            return
+        if name == "edit_entry":
+            worklog.update_entry(entry, task_name=rng.choice(TASKS),
+                                 minutes=rng.randint(5, 480))
+        else:
+            worklog.remove_entry(entry)
+    elif name == "find_by_employee":
+        list(worklog.search_by_employee(rng.choice(EMPLOYEES).split()[0]))
+    elif name == "find_by_date":
+        list(worklog.search_by_date(random_date(rng)))
+    elif name == "find_by_date_range":
+        start_date = random_date(rng)
+        end_date = max(start_date, random_date(rng))
+        list(worklog.search_by_date_range(start_date, end_date))
+    elif name == "find_by_keyword":
+        list(worklog.search_by_keyword(rng.choice(TASKS)))
+
+
+def is_lock_error(error):
+    """
+    Check if an OperationalError was caused by lock contention, including a
+    full-text search that couldn't read its settings while locked out.
+    """
+    message = str(error).lower()
+    return ("locked" in message or "busy" in message
+            or FTS_LOCKED_MESSAGE in message)
+
+
+def new_result():
+    """Return empty results for one operation."""
+    return {"latencies": [], "failed": 0, "lock_wait": 0.0, "errors": {}}
+
+
+def count_error(result, error):
+    """Count a failed transaction under its error type and message."""
+    key = "{}: {}".format(type(error).__name__, error)
+    result["errors"][key] = result["errors"].get(key, 0) + 1
+
+
+def set_pragmas(pragmas, retries=3, database=db):
+    """Run `PRAGMA name = value` for each pair, retrying on lock errors."""
+    for name, value in pragmas:
+        for attempt in range(retries + 1):
+            try:
+                database.execute_sql("PRAGMA {} = {}".format(name, value))
+            except OperationalError as error:
+                if not is_lock_error(error) or attempt == retries:
+                    raise
+            else:
+                break
+
+
+def run_workload(seed, duration=None, operations=None, retries=3,
+                 pragmas=(), database=db, workload=WORKLOAD):
+    """
+    Run random operations until `duration` seconds have passed or
+    `operations` operations have been done. Each operation runs in its own
+    transaction and is retried up to `retries` times on lock errors; any
+    other error fails it straight away. Writes start with BEGIN IMMEDIATE,
+    and the time taken to get that lock (including time in SQLite's busy
+    handler) is counted as lock wait. Returns a dictionary of results keyed
+    by operation name.
+    """
+    rng = random.Random(seed)
+    names = [name for name, weight in workload]
+    weights = [weight for name, weight in workload]
+    results = {name: new_result() for name in names}
+    set_pragmas(pragmas, retries, database)
+    state = {"max_id": get_max_id()}
+
+    deadline = time.perf_counter() + duration if duration else None
+    done = 0
+    while operations is None or done < operations:
+        start = time.perf_counter()
+        if deadline and start > deadline:
+            break
+        name = rng.choices(names, weights)[0]
+        result = results[name]
+        for attempt in range(retries + 1):
+            if name in WRITES:
+                transaction = database.atomic(transaction_type="IMMEDIATE")
+            else:
+                transaction = database.atomic()
+            begin = time.perf_counter()
+            locked = False
+            try:
+                with transaction:
+                    if name in WRITES:
+                        result["lock_wait"] += time.perf_counter() - begin
+                        locked = True
+                    run_operation(name, rng, state)
+            except Exception as error:
+                retry = (isinstance(error, OperationalError)
+                         and is_lock_error(error))
+                if retry and not locked:
+                    result["lock_wait"] += time.perf_counter() - begin
+                if not retry or attempt == retries:
+                    result["failed"] += 1
+                    count_error(result, error)
+                    break
+            else:
+                break
+        result["latencies"].append(time.perf_counter() - start)
+        done += 1
+    return results
+
+
+def merge_results(all_results):
+    """Combine the results of several workers into one dictionary."""
+    merged = {}
+    for results in all_results:
+        for name, result in results.items():
+            total = merged.setdefault(name, new_result())
+            total["latencies"].extend(result["latencies"])
+            total["failed"] += result["failed"]
+            total["lock_wait"] += result["lock_wait"]
+            for error, count in result["errors"].items():
+                total["errors"][error] = total["errors"].get(error, 0) + count
+    return merged
+
+
+def run_process(path, seed, threads, duration, retries, pragmas):
+    """
+    Run `threads` workload threads against the database at `path`. A
+    thread that fails outside an operation (e.g. while setting pragmas)
+    reports the error as a failed "setup" step.
+    """
+    db.init(path)
+    all_results = [None] * threads
+
+    def worker(index):
+        try:
+            all_results[index] = run_workload(
+                seed * 1000 + index, duration, retries=retries,
+                pragmas=pragmas)
+        except Exception as error:
+            result = new_result()
+            result["failed"] += 1
+            count_error(result, error)
+            all_results[index] = {"setup": result}
+        finally:
+            db.close()
+
+    workers = [threading.Thread(target=worker, args=(index,))
+               for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return merge_results(all_results)
+
+
+def run_stress(path, processes, threads, duration, retries=3, pragmas=()):
+    """
+    Run the workload in `processes` processes of `threads` threads each.
+    Returns the merged results and the seconds taken.
+    """
+    jobs = [(path, seed, threads, duration, retries, pragmas)
+            for seed in range(processes)]
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        all_results = pool.starmap(run_process, jobs)
+    elapsed = time.perf_counter() - start
+    return merge_results(all_results), elapsed
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of a sorted list of values."""
+    if not values:
+        return 0.0
+    rank = max(int(math.ceil(percent / 100.0 * len(values))) - 1, 0)
+    return values[rank]
+
+
+def print_report(results, elapsed):
+    """Print throughput, latency percentiles, lock waits and failures."""
+    total = sum(len(result["latencies"]) for result in results.values())
+    print("{} operations in {:.2f} seconds ({:.1f} ops/s)\n".format(
+        total, elapsed, total / elapsed if elapsed else 0.0))
+    print("{:<20}{:>8}{:>10}{:>10}{:>10}{:>12}{:>8}".format(
+        "Operation", "Count", "p50 ms", "p95 ms", "p99 ms", "Lock wait s",
+        "Failed"))
+    for name, result in sorted(results.items()):
+        latencies = sorted(result["latencies"])
+        print("{:<20}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}{:>12.3f}{:>8}".format(
+            name,
+            len(latencies),
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 95) * 1000,
+            percentile(latencies, 99) * 1000,
+            result["lock_wait"],
+            result["failed"]))
+
+    errors = merge_errors(results)
+    if errors:
+        print("\nErrors:")
+        for error, count in sorted(errors.items(), key=lambda item: -item[1]):
+            print("{:>8}  {}".format(count, error))
+
+
+def merge_errors(results):
+    """Count the errors behind failed transactions across all operations."""
+    errors = {}
+    for result in results.values():
+        for error, count in result["errors"].items():
+            errors[error] = errors.get(error, 0) + count
+    return errors
+
+
+def remove_database(path):
+    """Delete a database file along with its journal and WAL files."""
+    for suffix in ("",) + SIDE_FILES:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--database", default="stress.db",
+                        help="database file to test (default: stress.db)")
+    parser.add_argument("--fresh", action="store_true",
+                        help="delete the database file first if it exists")
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=2,
+                        help="threads per process")
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="seconds to run the workload for")
+    parser.add_argument("--rows", type=int, default=1000,
+                        help="entries to insert before the run")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="retries for a transaction that hits a lock")
+    parser.add_argument("--journal-mode", default="delete",
+                        help="PRAGMA journal_mode, e.g. delete or wal")
+    parser.add_argument("--synchronous", default="full",
+                        help="PRAGMA synchronous for every connection")
+    parser.add_argument("--busy-timeout", type=int, default=100,
+                        help="PRAGMA busy_timeout in milliseconds")
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        if not args.fresh:
+            parser.error("{} already exists; pass --fresh to delete it and "
+                         "start over".format(args.database))
+        remove_database(args.database)
+
+    # Only WAL is stored in the file, so every connection sets the mode
+    pragmas = [("busy_timeout", args.busy_timeout),
+               ("journal_mode", args.journal_mode),
+               ("synchronous", args.synchronous)]
+    db.init(args.database)
+    db.connect()
+    db.create_tables([Entry], safe=True)
+    set_pragmas(pragmas)
+    populate(args.rows)
+    db.close()
+
+    results, elapsed = run_stress(args.database, args.processes,
+                                  args.threads, args.duration, args.retries,
+                                  pragmas)
+    print_report(results, elapsed)
+
+
+if __name__ == '__main__':
+    main()
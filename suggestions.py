@@ -0,0 +1,228 @@
+"""
+Task name suggestions ranked by how often each name has been used.
+
+The index is loaded once from the database on first use and then kept up to
+date by create_entry(), update_entry() and remove_entry() in worklog.py, so
+suggestions never need a query. The best few names are cached for every prefix that
+matches many names; the rest are ranked from a short stretch of a sorted
+list found with a binary search.
+"""
+from entry import Entry
+
+import heapq
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from peewee import fn
+
+try:
+    import readline
+except ImportError:
+    readline = None
+else:
+    # Bound once; libedit (macOS) has its own syntax for it
+    if "libedit" in (readline.__doc__ or ""):
+        readline.parse_and_bind("bind ^I rl_complete")
+    else:
+        readline.parse_and_bind("tab: complete")
+
+
+# Number of names cached for each prefix
+CACHED_NAMES = 10
+# Prefixes matching more names than this have their best names cached;
+# the others are ranked on the fly, which stays cheap
+SCAN_LIMIT = 64
+
+
+class TaskNameIndex:
+    """
+    Task names and their use counts, searchable by prefix. Every prefix that
+    matches more than SCAN_LIMIT names has its best CACHED_NAMES names
+    cached, built from the caches of its one-character-longer prefixes.
+    """
+
+    def __init__(self, counts=None):
+        self.counts = dict(counts or {})
+        # (lowercase name, name) pairs, sorted for prefix searches
+        self.keys = sorted((name.lower(), name) for name in self.counts)
+        self.top = {}
+        self._best("", 0, len(self.keys), build=True)
+
+    def _rank(self, name):
+        """Sort key putting the most used names first."""
+        return (-self.counts[name], name)
+
+    def _range(self, prefix, start=0, end=None):
+        """Positions in self.keys of the names starting with `prefix`."""
+        if end is None:
+            end = len(self.keys)
+        start = bisect_left(self.keys, (prefix,), start, end)
+        if prefix:
+            end = bisect_left(
+                self.keys, (prefix[:-1] + chr(ord(prefix[-1]) + 1),),
+                start, end)
+        return start, end
+
+    def _scan(self, start, end, limit):
+        """Rank the names in self.keys[start:end]."""
+        names = (name for key, name in self.keys[start:end])
+        return heapq.nsmallest(limit, names, key=self._rank)
+
+    def _best(self, prefix, start, end, build=False):
+        """
+        The best CACHED_NAMES names in self.keys[start:end], which all start
+        with `prefix`. Large ranges are answered by merging the cached lists
+        of the longer prefixes; with `build` those lists are (re)made first
+        and the result is cached too.
+        """
+        if end - start <= SCAN_LIMIT:
+            return self._scan(start, end, CACHED_NAMES)
+
+        depth = len(prefix)
+        candidates = []
+        position = start
+        # Names equal to the prefix sort first
+        while position < end and len(self.keys[position][0]) == depth:
+            candidates.append(self.keys[position][1])
+            position += 1
+        while position < end:
+            child = self.keys[position][0][:depth + 1]
+            child_start, child_end = self._range(child, position, end)
+            names = None if build else self.top.get(child)
+            if names is None:
+                names = self._best(child, child_start, child_end, build)
+            candidates.extend(names)
+            position = child_end
+
+        best = heapq.nsmallest(CACHED_NAMES, candidates, key=self._rank)
+        if build:
+            self.top[prefix] = best
+        return best
+
+    def _prefixes(self, name):
+        """Every prefix of `name`, shortest first."""
+        key = name.lower()
+        return [key[:length] for length in range(len(key) + 1)]
+
+    def suggest(self, prefix, limit=5):
+        """Return up to `limit` names starting with `prefix`, most used first."""
+        prefix = prefix.lower()
+        if limit <= CACHED_NAMES:
+            names = self.top.get(prefix)
+            if names is not None:
+                return names[:limit]
+        # Uncached prefixes match at most SCAN_LIMIT names
+        start, end = self._range(prefix)
+        return self._scan(start, end, limit)
+
+    def add(self, name, count=1):
+        """Count `count` more uses of a task name."""
+        new = name not in self.counts
+        if new:
+            self.counts[name] = 0
+            insort(self.keys, (name.lower(), name))
+        self.counts[name] += count
+        for prefix in self._prefixes(name):
+            names = self.top.get(prefix)
+            if names is None:
+                # Longer prefixes match fewer names, so none are cached
+                # unless this new name pushed them over the limit
+                if not new:
+                    break
+                start, end = self._range(prefix)
+                if end - start <= SCAN_LIMIT:
+                    break
+                self.top[prefix] = self._best(prefix, start, end)
+                continue
+            if name not in names:
+                names.append(name)
+            names.sort(key=self._rank)
+            del names[CACHED_NAMES:]
+
+    def remove(self, name, count=1):
+        """Count `count` fewer uses of a task name."""
+        if name not in self.counts:
+            return
+        self.counts[name] -= count
+        if self.counts[name] <= 0:
+            del self.counts[name]
+            del self.keys[bisect_left(self.keys, (name.lower(), name))]
+        # Longest first, so each prefix is rebuilt from up-to-date children
+        for prefix in reversed(self._prefixes(name)):
+            names = self.top.get(prefix)
+            if names is None or name not in names:
+                continue
+            if name in self.counts:
+                names.sort(key=self._rank)
+                if names[-1] != name:
+                    continue
+            # A name outside the cache may now rank higher, so rebuild it
+            self.top[prefix] = self._best(prefix, *self._range(prefix))
+
+
+_index = None
+
+
+def load_index():
+    """Build the index from the task names in the database."""
+    counts = (Entry
+              .select(Entry.task_name, fn.COUNT(Entry.id))
+              .group_by(Entry.task_name)
+              .tuples())
+    return TaskNameIndex(dict(counts))
+
+
+def get_index():
+    """Return the task name index, loading it on first use."""
+    global _index
+    if _index is None:
+        _index = load_index()
+    return _index
+
+
+def reset_index():
+    """Forget the loaded index so the next use reloads it."""
+    global _index
+    _index = None
+
+
+def suggest_task_names(prefix, limit=5):
+    """Return up to `limit` task names starting with `prefix`."""
+    return get_index().suggest(prefix, limit)
+
+
+def record_task_name(name):
+    """Count a new use of a task name, if the index is loaded."""
+    if _index is not None:
+        _index.add(name)
+
+
+def forget_task_name(name):
+    """Count one less use of a task name, if the index is loaded."""
+    if _index is not None:
+        _index.remove(name)
+
+
+@contextmanager
+def task_name_completion():
+    """Complete task names with TAB while prompting, if readline exists."""
+    if readline is None:
+        yield
+        return
+
+    matches = []
+
+    def complete(text, state):
+        if state == 0:
+            matches[:] = suggest_task_names(text)
+        return matches[state] if state < len(matches) else None
+
+    old_completer = readline.get_completer()
+    old_delims = readline.get_completer_delims()
+    # Task names contain spaces, so complete the whole line
+    readline.set_completer_delims("")
+    readline.set_completer(complete)
+    try:
+        yield
+    finally:
+        readline.set_completer(old_completer)
+        readline.set_completer_delims(old_delims)
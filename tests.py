@@ -5,13 +5,25 @@ from playhouse.test_utils import test_database
 from peewee import *
 from datetime import datetime
 
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+
+import analytics
+import maintenance
+import stress
+import suggestions
 import worklog
 from entry import Entry
+from plan_tests import QueryPlanTests
 
 
 TEST_DB = SqliteDatabase(':memory:')
 TEST_DB.connect()
-TEST_DB.create_tables([Entry], safe=True)
+with Using(TEST_DB, [Entry]):
+    TEST_DB.create_tables([Entry], safe=True)
 
 DATA = {
     "employee_name": "Brian Weber",
@@ -76,17 +88,18 @@ class WorkLogTests(unittest.TestCase):
 
 
     def test_add_entry(self):
-        with mock.patch('builtins.input',
-            side_effect=["2016-12-25", "Name", "Surfing", 45,
-            "Hang ten dude!", "y", ""]
-            , return_value=DATA):
-            assert worklog.add_entry()["task_name"] == DATA["task_name"]
+        with test_database(TEST_DB, (Entry,)):
+            with mock.patch('builtins.input',
+                side_effect=["2016-12-25", "Name", "Surfing", 45,
+                "Hang ten dude!", "y", ""]
+                , return_value=DATA):
+                assert worklog.add_entry()["task_name"] == DATA["task_name"]
 
-        with mock.patch('builtins.input',
-            side_effect=["2016-12-25", "Name", "Surfing", 45,
-            "Hang ten dude!", "n", ""]
-            , return_value=DATA):
-            assert worklog.add_entry() == None
+            with mock.patch('builtins.input',
+                side_effect=["2016-12-25", "Name", "Surfing", 45,
+                "Hang ten dude!", "n", ""]
+                , return_value=DATA):
+                assert worklog.add_entry() == None
 
 
     def test_search_entries(self):
@@ -113,6 +126,15 @@ class WorkLogTests(unittest.TestCase):
                 assert worklog.search_entries().count() == 1
 
 
+    def test_search_by_employee(self):
+        with test_database(TEST_DB, (Entry,)):
+            self.create_entries()
+            Entry.create(**DATA_name)
+            self.assertEqual(worklog.search_by_employee("Weber").count(), 2)
+            self.assertEqual(worklog.search_by_employee("bobby").count(), 1)
+            self.assertEqual(worklog.search_by_employee("Smith").count(), 0)
+
+
     def test_edit_entry(self):
         with test_database(TEST_DB, (Entry,)):
             self.create_entries()
@@ -188,5 +210,320 @@ class WorkLogTests(unittest.TestCase):
         pass
 
 
+class MaintenanceTests(unittest.TestCase):
+    def test_get_database_stats(self):
+        stats = maintenance.get_database_stats(TEST_DB)
+        self.assertGreater(stats["size"], 0)
+        self.assertGreaterEqual(stats["freelist_pages"], 0)
+
+
+    def test_backup_database(self):
+        with test_database(TEST_DB, (Entry,)):
+            Entry.create(**DATA)
+            with tempfile.TemporaryDirectory() as backup_dir:
+                path = os.path.join(backup_dir, "backup.db")
+                maintenance.backup_database(path, database=TEST_DB)
+                backup = sqlite3.connect(path)
+                count = backup.execute("SELECT COUNT(*) FROM entry").fetchone()
+                backup.close()
+                self.assertEqual(count[0], 1)
+
+
+    def test_backup_database_while_writing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "entries.db")
+            database = SqliteDatabase(path)
+            with Using(database, [Entry]):
+                database.create_tables([Entry], safe=True)
+                database.execute_sql("PRAGMA journal_mode = wal")
+                stress.populate(20000, database=database)
+            stop = threading.Event()
+            backups = []
+
+            def write():
+                writer = sqlite3.connect(path, timeout=5)
+                while not stop.is_set():
+                    with writer:
+                        writer.execute(
+                            "UPDATE entry SET minutes = minutes + 1 "
+                            "WHERE id = 1")
+                writer.close()
+
+            def backup():
+                backups.append(maintenance.backup_database(
+                    os.path.join(directory, "backup.db"), database=database))
+                database.close()
+
+            writer = threading.Thread(target=write)
+            writer.start()
+            backup_thread = threading.Thread(target=backup, daemon=True)
+            backup_thread.start()
+            backup_thread.join(10)
+            stop.set()
+            writer.join()
+            self.assertFalse(backup_thread.is_alive(),
+                             "Backup never finished")
+            copy = sqlite3.connect(backups[0])
+            count = copy.execute("SELECT COUNT(*) FROM entry").fetchone()
+            copy.close()
+            self.assertEqual(count[0], 20000)
+
+
+    def test_run_maintenance(self):
+        with test_database(TEST_DB, (Entry,)):
+            Entry.create(**DATA)
+            report = maintenance.run_maintenance(database=TEST_DB)
+            self.assertIsNone(report["backup"])
+            self.assertEqual(report["changes_pruned"], 0)
+            self.assertEqual(report["freelist_after"], 0)
+            self.assertEqual(
+                maintenance.pragma("auto_vacuum", TEST_DB),
+                maintenance.AUTO_VACUUM_INCREMENTAL)
+
+            # Later runs reclaim pages without a full VACUUM
+            stress.populate(500, database=TEST_DB)
+            Entry.delete().execute()
+            self.assertGreater(
+                maintenance.get_database_stats(TEST_DB)["freelist_pages"], 1)
+            report = maintenance.run_maintenance(database=TEST_DB)
+            self.assertEqual(report["freelist_after"], 0)
+
+
+    def test_optimize(self):
+        stat = ("SELECT stat FROM sqlite_stat1 "
+                "WHERE idx = 'entry_date'")
+        with test_database(TEST_DB, (Entry,)):
+            stress.populate(10, database=TEST_DB)
+            maintenance.optimize(TEST_DB)
+            before = TEST_DB.execute_sql(stat).fetchone()
+            stress.populate(1000, database=TEST_DB)
+            maintenance.optimize(TEST_DB)
+            after = TEST_DB.execute_sql(stat).fetchone()
+            self.assertNotEqual(before, after)
+
+
+    def test_start_scheduler(self):
+        reports = []
+        ran = threading.Event()
+
+        def on_report(report):
+            reports.append(report)
+            ran.set()
+
+        with mock.patch('maintenance.run_maintenance',
+            side_effect=[OperationalError("database is locked"),
+                         {"seconds": 0.0}]):
+            with self.assertLogs('maintenance', level='ERROR'):
+                stop = maintenance.start_scheduler(0.01, on_report=on_report)
+                self.assertTrue(ran.wait(5))
+            stop.set()
+        self.assertEqual(reports, [{"seconds": 0.0}])
+
+
+class StressTests(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(stress.percentile(values, 50), 50)
+        self.assertEqual(stress.percentile(values, 99), 99)
+        self.assertEqual(stress.percentile([], 50), 0.0)
+
+
+    def test_is_lock_error(self):
+        self.assertTrue(stress.is_lock_error(
+            OperationalError("database is locked")))
+        self.assertTrue(stress.is_lock_error(
+            OperationalError("vtable constructor failed: entry_fts")))
+        self.assertFalse(stress.is_lock_error(
+            OperationalError("no such table: entry")))
+
+
+    def test_run_workload(self):
+        with test_database(TEST_DB, (Entry,)):
+            stress.populate(20, database=TEST_DB)
+            results = stress.run_workload(1, operations=50, database=TEST_DB)
+            total = sum(len(result["latencies"])
+                        for result in results.values())
+            self.assertEqual(total, 50)
+            self.assertEqual(
+                sum(result["failed"] for result in results.values()), 0)
+
+
+    def test_run_workload_counts_errors(self):
+        with test_database(TEST_DB, (Entry,)):
+            with mock.patch('stress.run_operation',
+                side_effect=ValueError("boom")):
+                results = stress.run_workload(
+                    1, operations=10, database=TEST_DB,
+                    workload=[("find_by_date", 1)])
+        self.assertEqual(results["find_by_date"]["failed"], 10)
+        self.assertEqual(results["find_by_date"]["errors"],
+                         {"ValueError: boom": 10})
+
+
+    def test_run_stress(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "stress.db")
+            database = SqliteDatabase(path)
+            with Using(database, [Entry]):
+                database.create_tables([Entry], safe=True)
+                stress.populate(100, database=database)
+            database.close()
+            results, elapsed = stress.run_stress(
+                path, processes=2, threads=2, duration=0.5,
+                pragmas=[("busy_timeout", 100)])
+        self.assertEqual(set(results), set(dict(stress.WORKLOAD)))
+        self.assertGreater(
+            sum(len(result["latencies"]) for result in results.values()), 0)
+
+
+class AnalyticsTests(unittest.TestCase):
+    def test_minutes_by(self):
+        with test_database(TEST_DB, (Entry,)):
+            Entry.create(**DATA)
+            Entry.create(**DATA_name)
+            Entry.create(**dict(DATA, date="2016-12-26", minutes=30))
+            report = analytics.EntryColumns(TEST_DB).load()
+            week = analytics.date(2016, 12, 19)
+
+            self.assertEqual(report.minutes_by(("employee", "week")), {
+                ("Brian Weber", week): 120,
+                ("Bobby Weber", week): 120,
+                ("Brian Weber", analytics.date(2016, 12, 26)): 30})
+            self.assertEqual(
+                report.minutes_by(("task",), "2016-12-26", "2016-12-31"),
+                {("Surfing",): 30})
+            self.assertEqual(report.top(1, ("employee",)),
+                             [(("Brian Weber",), 150)])
+
+
+    def test_refresh(self):
+        with test_database(TEST_DB, (Entry,)):
+            entry = Entry.create(**DATA)
+            Entry.create(**DATA_name)
+            report = analytics.EntryColumns(TEST_DB).load()
+
+            worklog.update_entry(entry, task_name="Coding")
+            Entry.create(**dict(DATA, minutes=15))
+            Entry.get(Entry.employee_name == "Bobby Weber").delete_instance()
+
+            self.assertEqual(report.refresh(), 3)
+            self.assertEqual(report.minutes_by(("task",)),
+                             {("Coding",): 120, ("Surfing",): 15})
+
+
+    def test_change_log_consumers(self):
+        with test_database(TEST_DB, (Entry,)):
+            analytics.disable_change_log(TEST_DB)
+            first = analytics.EntryColumns(TEST_DB).load()
+            second = analytics.EntryColumns(TEST_DB).load()
+            Entry.create(**DATA)
+
+            self.assertEqual(first.refresh(), 1)
+            self.assertEqual(analytics.prune_change_log(TEST_DB), 0)
+            self.assertEqual(second.refresh(), 1)
+            self.assertEqual(analytics.prune_change_log(TEST_DB), 1)
+
+            first.close()
+            second.close()
+            analytics.prune_change_log(TEST_DB)
+            self.assertFalse(analytics.change_log_enabled(TEST_DB))
+            self.assertEqual(first.refresh(), 1)
+            analytics.disable_change_log(TEST_DB)
+
+
+class SuggestionTests(unittest.TestCase):
+    def setUp(self):
+        suggestions.reset_index()
+        self.addCleanup(suggestions.reset_index)
+
+
+    def test_task_name_index(self):
+        index = suggestions.TaskNameIndex(
+            {"Surfing": 3, "Surf lessons": 5, "Sleeping": 1, "Coding": 2})
+        self.assertEqual(index.suggest("s"),
+                         ["Surf lessons", "Surfing", "Sleeping"])
+        self.assertEqual(index.suggest("SURF L"), ["Surf lessons"])
+        self.assertEqual(index.suggest("x"), [])
+
+        index.add("Sleeping", 5)
+        self.assertEqual(index.suggest("s", limit=1), ["Sleeping"])
+        index.remove("Surf lessons", 5)
+        self.assertEqual(index.suggest("su"), ["Surfing"])
+        self.assertEqual(index.suggest("surf l"), [])
+
+
+    def test_task_name_index_cached_prefixes(self):
+        rng = random.Random(0)
+        counts = {}
+        for _ in range(500):
+            name = "".join(rng.choice("abc") for _ in range(6))
+            counts[name] = rng.randint(1, 9)
+        index = suggestions.TaskNameIndex(counts)
+        self.assertIn("a", index.top)
+        self.assertNotIn("abc", index.top)
+
+        def expected(prefix):
+            names = [name for name in counts if name.startswith(prefix)]
+            names.sort(key=lambda name: (-counts[name], name))
+            return names[:suggestions.CACHED_NAMES]
+
+        for step in range(300):
+            name = rng.choice(list(counts))
+            if step % 3:
+                index.remove(name, 3)
+                counts[name] -= 3
+                if counts[name] <= 0:
+                    del counts[name]
+            else:
+                index.add(name + "x")
+                counts[name + "x"] = counts.get(name + "x", 0) + 1
+            for prefix in ("", "a", "ab", "abc", name[:4], name):
+                self.assertEqual(
+                    index.suggest(prefix, suggestions.CACHED_NAMES),
+                    expected(prefix))
+
+
+    @unittest.skipIf(suggestions.readline is None, "readline is missing")
+    def test_task_name_completion(self):
+        readline = suggestions.readline
+        old_completer = readline.get_completer()
+        with test_database(TEST_DB, (Entry,)):
+            Entry.create(**DATA)
+            with suggestions.task_name_completion():
+                complete = readline.get_completer()
+                self.assertEqual(complete("su", 0), "Surfing")
+                self.assertIsNone(complete("su", 1))
+        self.assertIs(readline.get_completer(), old_completer)
+
+
+    def test_suggest_task_names(self):
+        with test_database(TEST_DB, (Entry,)):
+            Entry.create(**DATA)
+            self.assertEqual(suggestions.suggest_task_names("sur"),
+                             ["Surfing"])
+
+            worklog.create_entry(dict(DATA, task_name="Sunbathing"))
+            worklog.create_entry(dict(DATA, task_name="Sunbathing"))
+            self.assertEqual(suggestions.suggest_task_names("su"),
+                             ["Sunbathing", "Surfing"])
+
+            with mock.patch('builtins.input',
+                side_effect=["Sun?", "Sunbathing"]):
+                self.assertEqual(worklog.get_task_name(), "Sunbathing")
+            with mock.patch('builtins.input',
+                side_effect=["Why is CI red?"]):
+                self.assertEqual(worklog.get_task_name(), "Why is CI red?")
+
+            entry = Entry.get(Entry.task_name == "Surfing")
+            with mock.patch('builtins.input', side_effect=["Sunbathing", ""]):
+                worklog.edit_task_name(entry)
+            self.assertEqual(suggestions.suggest_task_names("su"),
+                             ["Sunbathing"])
+
+            worklog.update_entry(entry, task_name="Surfing")
+            self.assertEqual(suggestions.suggest_task_names("su"),
+                             ["Sunbathing", "Surfing"])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -16,7 +16,8 @@ particular employee, and list all entries that match a date or search term.
 Print a report of this information to the screen, including the date, title of
 task, time spent, employee, and general notes.
 """
-from entry import Entry, initialize
+from entry import Entry, EntrySearch, FULL_TEXT_SEARCH, initialize
+import suggestions
 
 import os, sys
 from collections import OrderedDict
@@ -40,14 +41,36 @@ def get_employee_name():
 
 
 def get_task_name():
-    """Prompt the employee for the task name."""
-    while True:
-        task_name = input("Enter a task name: ")
-        if len(task_name) == 0:
-            print("\nYou must enter a task name!\n")
-            continue
-        else:
-            return task_name
+    """
+    Prompt the employee for the task name. TAB completes known task names
+    where readline is available, and a single word ending with ? lists the
+    names starting with it. Task names with spaces may end with ?.
+    """
+    with suggestions.task_name_completion():
+        while True:
+            task_name = input("Enter a task name (a word ending with ? "
+                "lists suggestions): ")
+            if len(task_name) == 0:
+                print("\nYou must enter a task name!\n")
+                continue
+            elif task_name.endswith("?") and " " not in task_name:
+                display_task_suggestions(task_name[:-1])
+                continue
+            else:
+                return task_name
+
+
+def display_task_suggestions(prefix):
+    """Print the most used task names starting with prefix."""
+    names = suggestions.suggest_task_names(prefix.strip())
+    if names:
+        print("\nSuggested task names:\n")
+        for name in names:
+            print(name)
+        print("")
+    else:
+        print("\nNo task names start with {}!\n".format(prefix))
+    return names
 
 
 def get_time_spent():
@@ -100,6 +123,7 @@ Notes: {notes}
 def create_entry(entry):
     """Create entry in database."""
     Entry.create(**entry)
+    suggestions.record_task_name(entry["task_name"])
     return entry
 
 
@@ -145,13 +169,73 @@ def select_all_entries():
     return entries
 
 
+def search_by_employee(employee_name):
+    """Gets all entries whose employee name contains the search term."""
+    entries = select_all_entries()
+    if not FULL_TEXT_SEARCH:
+        return entries.where(Entry.employee_name.contains(employee_name))
+    matches = EntrySearch.select(EntrySearch.rowid).where(
+        EntrySearch.employee_name.contains(employee_name))
+    return entries.where(Entry.id << matches)
+
+
+def search_by_exact_employee(employee_name):
+    """Gets all entries for exactly one employee name."""
+    entries = select_all_entries()
+    return entries.where(Entry.employee_name == employee_name)
+
+
+def search_by_date(date):
+    """Gets all entries for a date given as YYYY-MM-DD."""
+    entries = select_all_entries()
+    return entries.where(Entry.date == date)
+
+
+def search_by_date_range(start_date, end_date):
+    """Gets all entries between two dates given as YYYY-MM-DD."""
+    entries = select_all_entries()
+    return entries.where(Entry.date >= start_date, Entry.date <= end_date)
+
+
+def search_by_keyword(keyword):
+    """Gets all entries with the keyword in the task name or notes."""
+    entries = select_all_entries()
+    if not FULL_TEXT_SEARCH:
+        return entries.where(
+            Entry.task_name.contains(keyword)|Entry.notes.contains(keyword))
+    matches = (
+        EntrySearch.select(EntrySearch.rowid).where(
+            EntrySearch.task_name.contains(keyword)) |
+        EntrySearch.select(EntrySearch.rowid).where(
+            EntrySearch.notes.contains(keyword)))
+    return entries.where(Entry.id << matches)
+
+
+def update_entry(entry, **fields):
+    """Update fields of an entry and save it to the database."""
+    old_task_name = entry.task_name
+    for field, value in fields.items():
+        setattr(entry, field, value)
+    entry.save()
+    if "task_name" in fields:
+        suggestions.forget_task_name(old_task_name)
+        suggestions.record_task_name(entry.task_name)
+    return entry
+
+
+def remove_entry(entry):
+    """Delete an entry from the database."""
+    deleted = entry.delete_instance()
+    suggestions.forget_task_name(entry.task_name)
+    return deleted
+
+
 def find_by_employee():
     """Search by an employee's name"""
     clear_screen()
     print("Search by Employee Name\n")
     user_input = get_employee_name()
-    entries = select_all_entries()
-    entries = entries.where(Entry.employee_name.contains(user_input))
+    entries = search_by_employee(user_input)
     entries = check_employee_name_match(entries)
     list_entries(entries, user_input)
     return entries
@@ -176,8 +260,7 @@ def check_employee_name_match(entries):
             employee_name = input(
                 "\nWhich employee would you like to search? ").strip()
             if employee_name in names:
-                entries = Entry.select().order_by(Entry.date.desc()).where(
-                    Entry.employee_name == employee_name)
+                entries = search_by_exact_employee(employee_name)
                 return entries
             else:
                 print("\n{} is not an employee's name given above!\n"
@@ -199,8 +282,7 @@ def find_by_date():
     user_input = get_date()
 
     # Find and display all entries.
-    entries = select_all_entries()
-    entries = entries.where(Entry.date == user_input)
+    entries = search_by_date(user_input)
     list_entries(entries, user_input)
     return entries
 
@@ -220,8 +302,7 @@ def find_by_date_range():
                 "Press ENTER to continue...")
             continue
 
-        entries = select_all_entries()
-        entries = entries.where(Entry.date >= start_date, Entry.date <= end_date)
+        entries = search_by_date_range(start_date, end_date)
         clear_screen()
         if entries:
             display_entries(entries)
@@ -238,16 +319,14 @@ def find_by_date_range():
         return entries
 
 
+def select_distinct_dates():
+    """Gets the distinct dates in the database, newest first."""
+    return Entry.select(Entry.date).distinct().order_by(Entry.date.desc())
+
+
 def get_all_distinct_dates_list():
     """Find a distinct dates in the databse. Returns a list of strings."""
-    dates = []
-    entries = select_all_entries()
-    entries = entries.order_by(Entry.date.desc())
-    for entry in entries:
-        date = entry.date
-        if date not in dates:
-            dates.append(date)
-    return dates
+    return [entry.date for entry in select_distinct_dates()]
 
 
 def convert_string_to_datetime(date):
@@ -267,9 +346,7 @@ def find_by_keyword():
     clear_screen()
     print("Search by Keyword\n")
     user_input = input("Enter a search term: ")
-    entries = select_all_entries()
-    entries = entries.where(
-        Entry.task_name.contains(user_input)|Entry.notes.contains(user_input))
+    entries = search_by_keyword(user_input)
     list_entries(entries, user_input)
     return entries
 
@@ -309,32 +386,28 @@ def edit_entry(index, entries):
 
 def edit_task_name(entry):
     """Edit a task name for an entry."""
-    entry.task_name = get_task_name()
-    entry.save()
+    update_entry(entry, task_name=get_task_name())
     input("Edit successful! Press ENTER to continue.")
     return entry
 
 
 def edit_date(entry):
     """Edit the date for an entry."""
-    entry.date = get_date()
-    entry.save()
+    update_entry(entry, date=get_date())
     input("Edit successful! Press ENTER to continue.")
     return entry
 
 
 def edit_time_spent(entry):
     """Edit the minutes for an entry."""
-    entry.minutes = get_time_spent()
-    entry.save()
+    update_entry(entry, minutes=get_time_spent())
     input("Edit successful! Press ENTER to continue.")
     return entry
 
 
 def edit_notes(entry):
     """Edit the notes for an entry."""
-    entry.notes = get_notes()
-    entry.save()
+    update_entry(entry, notes=get_notes())
     input("Edit successful! Press ENTER to continue.")
     return entry
 
@@ -349,7 +422,7 @@ def delete_entry(index, entries):
         "\nAre you sure you want to delete entry: y/[N] ").lower().strip()
 
     if user_input == 'y':
-        entry.delete_instance()
+        remove_entry(entry)
         print("\nEntry has been deleted!")
         input("\nPress ENTER to continue.")
         return None